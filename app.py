@@ -1,19 +1,38 @@
-from flask import Flask, request, send_file, jsonify, session
+from flask import Flask, Response, request, send_file, jsonify, session
+from flask.sessions import SecureCookieSessionInterface
 import os
-import uuid
-from datetime import datetime
+import secrets
 import zipfile
+import collections
+import contextlib
+import multiprocessing
+import gzip
+import zlib
+import hashlib
+import json
+import heapq
+import stat
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from werkzeug.utils import secure_filename
-from PIL import Image
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, Field, File, Data, Epilogue
+from cachetools import LRUCache, TTLCache
+from PIL import Image, ImageOps, ExifTags
+import numpy as np
 import io
+import threading
+from urllib.parse import unquote
 
 # Try different HEIC libraries
 HEIC_SUPPORT_METHOD = None
+_HEIC_READER = None  # imageio reader, resolved once below
 
 # Method 1: Try pillow-heif
 try:
     from pillow_heif import register_heif_opener
-    register_heif_opener()
+    # Only the primary image is converted; skip enumerating thumbnails and depth maps
+    register_heif_opener(thumbnails=False, depth_images=False)
     HEIC_SUPPORT_METHOD = "pillow-heif"
     print("✅ HEIC support enabled via pillow-heif")
 except ImportError:
@@ -23,11 +42,13 @@ except ImportError:
 if HEIC_SUPPORT_METHOD is None:
     try:
         import imageio.v3 as iio
+        _HEIC_READER = iio.imread
         HEIC_SUPPORT_METHOD = "imageio"
         print("✅ HEIC support enabled via imageio")
     except ImportError:
         try:
             import imageio
+            _HEIC_READER = imageio.imread
             HEIC_SUPPORT_METHOD = "imageio"
             print("✅ HEIC support enabled via imageio (v2)")
         except ImportError:
@@ -38,99 +59,769 @@ if HEIC_SUPPORT_METHOD is None:
 else:
     print(f"🎯 Using {HEIC_SUPPORT_METHOD} for HEIC conversion")
 
+# Optional: compiled alpha compositing for JPEG output
+if multiprocessing.parent_process() is not None:
+    # A pool worker (see get_convert_pool): one per core already, so a thread
+    # per core in each would oversubscribe. Request threads keep the parallel kernel.
+    os.environ.setdefault('NUMBA_NUM_THREADS', '1')
+try:
+    from numba import njit, prange, types
+    NUMBA_AVAILABLE = True
+    print("✅ Numba alpha compositing enabled")
+except ImportError:
+    NUMBA_AVAILABLE = False
+    print("⚠️  numba not available, using NumPy for alpha compositing")
+
+if NUMBA_AVAILABLE:
+    # Pixel arrays from PIL are read-only, so the input is typed as such.
+    # Compiled eagerly from the signature so no request pays the JIT cost.
+    @njit(types.void(types.Array(types.uint8, 3, 'C', readonly=True), types.uint8[:, :, ::1]),
+          parallel=True, cache=True, fastmath=True)
+    def _alpha_over_white(rgba, out):
+        for y in prange(rgba.shape[0]):
+            for x in range(rgba.shape[1]):
+                a = np.int32(rgba[y, x, 3])
+                for c in range(3):
+                    out[y, x, c] = (np.int32(rgba[y, x, c]) * a + 255 * (255 - a)) // 255
+    
+    # Warm-up launch at import starts the parallel thread pool ahead of the first request
+    _alpha_over_white(np.zeros((1, 1, 4), dtype=np.uint8), np.empty((1, 1, 3), dtype=np.uint8))
+
+# Numba's default threading layer does not allow concurrent kernel launches
+_ALPHA_LOCK = threading.Lock()
+
+# Optional: libjpeg-turbo for JPEG encoding
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJPF_GRAY, TJSAMP_420, TJSAMP_GRAY
+    _TJ = TurboJPEG()
+    print("✅ JPEG encoding via libjpeg-turbo")
+except (ImportError, OSError, RuntimeError):
+    # RuntimeError/OSError: the Python package is there but libturbojpeg is not
+    _TJ = None
+    print("⚠️  PyTurboJPEG not available, using Pillow for JPEG encoding")
+
+# Optional: libvips for PNG (and JPEG without libjpeg-turbo) encoding
+try:
+    # Files are already converted in parallel, one per worker, so a thread pool
+    # per libvips instance would only oversubscribe the cores
+    os.environ.setdefault('VIPS_CONCURRENCY', '1')
+    import pyvips
+    print("✅ PNG encoding via libvips")
+except (ImportError, OSError):
+    # OSError: the Python package is there but libvips is not
+    pyvips = None
+    print("⚠️  pyvips not available, using Pillow for PNG encoding")
+
+# Optional: BLAKE3 for signing the session cookie
+try:
+    from blake3 import blake3
+    print("✅ Session cookies signed with BLAKE3")
+except ImportError:
+    blake3 = None
+    print("⚠️  blake3 not available, signing session cookies with SHA-1")
+
+# Per-thread Pillow output buffer (see encode_with_pillow)
+_ENCODE_BUFFERS = threading.local()
+
+# PIL mode -> band count for handing decoded pixels to libvips
+_VIPS_BANDS = {'L': 1, 'LA': 2, 'RGB': 3, 'RGBA': 4}
+
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this'
 
+class Blake3SessionInterface(SecureCookieSessionInterface):
+    """Signed cookie sessions using HMAC-BLAKE3 instead of HMAC-SHA1"""
+    digest_method = staticmethod(blake3)
+
+if blake3 is not None:
+    # Cookies signed with the other digest fail verification and start a new session
+    app.session_interface = Blake3SessionInterface()
+
+# Behind Apache mod_xsendfile or lighttpd, let the front server send downloads
+# itself; otherwise send_file hands the file to gunicorn, which uses sendfile()
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true')
+
 # Configuration
 UPLOAD_FOLDER = 'temp_uploads'
 CONVERTED_FOLDER = 'temp_converted'
-ALLOWED_EXTENSIONS = {'heic', 'heif', 'jpg', 'jpeg', 'png', 'bmp', 'gif', 'tiff', 'webp'}
+ALLOWED_EXTENSIONS = frozenset({'heic', 'heif', 'jpg', 'jpeg', 'png', 'bmp', 'gif', 'tiff', 'webp'})
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+SPILL_THRESHOLD = 64 * 1024 * 1024  # Requests larger than this are buffered on disk
+MAX_MANIFEST_SIZE = 64 * 1024  # 64KB, for /convert-batch
+ARCHIVE_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# ftyp major brands of HEIC/HEIF files
+_HEIF_BRANDS = frozenset({b'heic', b'heix', b'hevc', b'hevx', b'heim', b'heis', b'mif1', b'msf1'})
+
+# (input extension, output format) pairs that would be a no-op conversion
+_SAME_FORMAT = frozenset({('png', 'png')})
+
+# Conversion history is kept server-side; the session cookie only carries an id.
+# It lives in this process, so run a single gunicorn worker (threads are fine).
+# TTLCache evicts the least recently used session when full and drops idle ones after a day.
+_HISTORY_MAX_SESSIONS = 10_000
+_HISTORY_TTL = 86400  # 1 day
+_HISTORY_PER_SESSION = 50
+_HISTORY = TTLCache(maxsize=_HISTORY_MAX_SESSIONS, ttl=_HISTORY_TTL)  # sid -> deque of entries
+_HISTORY_LOCK = threading.Lock()  # TTLCache is not thread-safe
+
+# Last formatted second (see timestamps)
+_TIMESTAMPS = (None, '', '')
+
+# Conversion worker processes, shared across requests (see get_convert_pool)
+_CONVERT_POOL = None
+_CONVERT_POOL_LOCK = threading.Lock()
+
+# CONVERT_EXECUTOR=thread converts batches in a thread pool instead: no pickling or
+# worker start-up, and libheif, libjpeg and zlib release the GIL while they work.
+# It is the default on Windows, where worker processes are expensive to spawn.
+CONVERT_EXECUTOR = (os.environ.get('CONVERT_EXECUTOR', '').strip() or ('thread' if os.name == 'nt' else 'process')).lower()
+if CONVERT_EXECUTOR not in ('thread', 'process'):
+    raise ValueError(f"CONVERT_EXECUTOR must be 'thread' or 'process', not {CONVERT_EXECUTOR!r}")
+_THREAD_POOL = ThreadPoolExecutor(max_workers=max(2, os.cpu_count() or 1)) if CONVERT_EXECUTOR == 'thread' else None
+
+# Finished conversions keyed by content hash and options (see cache_key)
+RESULT_CACHE_BYTES = 512 * 1024 * 1024  # 512MB
+
+class ResultCache(LRUCache):
+    """LRU of cache_key -> (path, size) that deletes the file when an entry is evicted"""
+    def popitem(self):
+        key, (path, size) = super().popitem()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return key, (path, size)
+
+_RESULT_CACHE = ResultCache(maxsize=RESULT_CACHE_BYTES, getsizeof=lambda entry: entry[1])
+_RESULT_CACHE_LOCK = threading.Lock()
+
+# Temp files are deleted FILE_TTL seconds after they are written (see schedule_expiry)
+FILE_TTL = 3600  # 1 hour
+_EXPIRY_HEAP = []
+_EXPIRY_COND = threading.Condition()
+_JANITOR = None
+
+# Content digests of /upload-raw files, taken while they streamed in (see cache_key)
+_RAW_DIGESTS = TTLCache(maxsize=10_000, ttl=FILE_TTL)  # upload id -> hex digest
+_RAW_DIGESTS_LOCK = threading.Lock()  # TTLCache is not thread-safe
 
 # Create directories if they don't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(CONVERTED_FOLDER, exist_ok=True)
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def _ext(filename):
+    """Lowercase extension without the dot, or '' if there is none"""
+    i = filename.rfind('.')
+    return filename[i + 1:].lower() if i >= 0 else ''
 
-def get_file_format(filename):
-    return filename.rsplit('.', 1)[1].lower() if '.' in filename else None
+def _sniff(fp):
+    """Return 'heic' if the stream starts with an HEIF ftyp box, else None"""
+    head = fp.read(12)
+    fp.seek(0)
+    # Major brand only: AVIF also lists mif1 as a compatible brand
+    if head[4:8] == b'ftyp' and head[8:12] in _HEIF_BRANDS:
+        return 'heic'
+    return None
+
+def content_hasher():
+    """Hash object for upload content, as used in cache keys"""
+    return hashlib.blake2b(digest_size=16)
+
+def copy_upload(stream, out, hasher=None):
+    """Copy an upload stream in 1MB chunks, enforcing MAX_FILE_SIZE inline"""
+    written = 0
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return True
+        written += len(chunk)
+        if written > MAX_FILE_SIZE:
+            return False
+        out.write(chunk)
+        if hasher:
+            hasher.update(chunk)
+
+def save_upload(stream, dest_path):
+    """Stream an upload to disk, returning its content digest
+    
+    Returns None, and drops the partial copy, if it is too large.
+    """
+    hasher = content_hasher()
+    with open(dest_path, 'wb') as out:
+        if copy_upload(stream, out, hasher):
+            return hasher.hexdigest()
+    
+    os.remove(dest_path)
+    return None
+
+def read_upload(stream):
+    """Read an upload into memory, or return None if it exceeds MAX_FILE_SIZE"""
+    buf = io.BytesIO()
+    return buf.getvalue() if copy_upload(stream, buf) else None
+
+def parse_manifest(data):
+    """Decode and check a /convert-batch manifest, raising ValueError if malformed"""
+    manifest = json.loads(data)
+    files = manifest.get('files') if isinstance(manifest, dict) else None
+    if not isinstance(files, list) or not files:
+        raise ValueError("Manifest must list at least one file")
+    for entry in files:
+        if not isinstance(entry, dict) or not isinstance(entry.get('name'), str) or not secure_filename(entry['name']):
+            raise ValueError("Every manifest entry needs a file name")
+    return manifest
+
+def read_batch(stream, boundary):
+    """Split a /convert-batch body, writing each file part straight to UPLOAD_FOLDER
+    
+    Returns (manifest, uploads, errors), with uploads as (name, None, temp_path,
+    digest) in manifest order. Raises ValueError if the body is malformed.
+    """
+    decoder = MultipartDecoder(boundary)
+    manifest = None
+    manifest_data = bytearray()
+    uploads = []
+    errors = []
+    part = -1
+    out = None
+    
+    try:
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, NeedData):
+                decoder.receive_data(stream.read(UPLOAD_CHUNK_SIZE) or None)
+            
+            elif isinstance(event, (Field, File)):
+                part += 1
+                if part == 0:
+                    continue
+                if part > len(manifest['files']):
+                    raise ValueError("More file parts than manifest entries")
+                entry = manifest['files'][part - 1]
+                filename = secure_filename(entry['name'])
+                temp_path = os.path.join(UPLOAD_FOLDER, f"temp_{secrets.token_hex(4)}_{filename}")
+                out = open(temp_path, 'wb')
+                written = 0
+                content = content_hasher()
+                hasher = hashlib.sha256() if entry.get('sha256') else None
+            
+            elif isinstance(event, Data) and part == 0:
+                manifest_data += event.data
+                if len(manifest_data) > MAX_MANIFEST_SIZE:
+                    raise ValueError("Manifest too large")
+                if not event.more_data:
+                    manifest = parse_manifest(manifest_data)
+            
+            elif isinstance(event, Data):
+                if out is not None:
+                    written += len(event.data)
+                    if written > MAX_FILE_SIZE:
+                        # Drop the rest of this part
+                        out.close()
+                        out = None
+                        os.remove(temp_path)
+                        errors.append(f"{filename}: File too large (max 16MB)")
+                    else:
+                        out.write(event.data)
+                        content.update(event.data)
+                        if hasher:
+                            hasher.update(event.data)
+                
+                if not event.more_data and out is not None:
+                    out.close()
+                    out = None
+                    if 'size' in entry and entry['size'] != written:
+                        os.remove(temp_path)
+                        errors.append(f"{filename}: Size does not match the manifest")
+                    elif hasher and hasher.hexdigest() != str(entry['sha256']).lower():
+                        os.remove(temp_path)
+                        errors.append(f"{filename}: Checksum does not match the manifest")
+                    else:
+                        uploads.append((filename, None, temp_path, content.hexdigest()))
+            
+            elif isinstance(event, Epilogue):
+                break
+        
+        if manifest is None:
+            raise ValueError("Missing manifest")
+    except BaseException:
+        if out is not None:
+            out.close()
+            os.remove(temp_path)
+        for _, _, path, _ in uploads:
+            os.remove(path)
+        raise
+    
+    # Parts the client listed but never sent
+    for entry in manifest['files'][max(part, 0):]:
+        errors.append(f"{secure_filename(entry['name'])}: Missing from request")
+    
+    return manifest, uploads, errors
 
 def convert_heic_with_imageio(input_path):
     """Convert HEIC using imageio"""
     try:
-        # Try imageio v3 first
-        try:
-            import imageio.v3 as iio
-            heic_array = iio.imread(input_path)
-        except:
-            # Fallback to imageio v2
-            import imageio
-            heic_array = imageio.imread(input_path)
-        
-        # Convert numpy array to PIL Image
-        if len(heic_array.shape) == 3:
-            pil_image = Image.fromarray(heic_array, 'RGB')
-        else:
-            pil_image = Image.fromarray(heic_array)
-        
-        return pil_image
+        heic_array = _HEIC_READER(input_path)
+        return Image.fromarray(heic_array, 'RGB' if heic_array.ndim == 3 else None)
     except Exception as e:
         raise Exception(f"imageio HEIC conversion failed: {str(e)}")
 
-def convert_image(input_path, output_format):
-    """Convert image to specified format with HEIC support"""
+def flatten_alpha(img):
+    """Blend a transparent image onto a white background in a single pass"""
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    rgba = np.ascontiguousarray(np.asarray(img))
+    
+    if NUMBA_AVAILABLE:
+        out = np.empty(rgba.shape[:2] + (3,), dtype=np.uint8)
+        with _ALPHA_LOCK:
+            _alpha_over_white(rgba, out)
+    else:
+        a = rgba[:, :, 3:4].astype(np.float32) * (1 / 255.0)
+        rgb = rgba[:, :, :3].astype(np.float32)
+        out = (rgb * a + 255.0 * (1.0 - a)).astype(np.uint8)
+    
+    return Image.fromarray(out, 'RGB')
+
+def encode_jpeg_turbo(img):
+    """Encode an RGB or L image with libjpeg-turbo, bypassing PIL's save path"""
+    if img.mode == 'RGB':
+        return _TJ.encode(np.asarray(img), quality=95, pixel_format=TJPF_RGB, jpeg_subsample=TJSAMP_420)
+    return _TJ.encode(np.asarray(img), quality=95, pixel_format=TJPF_GRAY, jpeg_subsample=TJSAMP_GRAY)
+
+def encode_with_pillow(img, f, *args, **kwargs):
+    """img.save() into this thread's reused buffer, then write it to f in one call"""
+    buffer = getattr(_ENCODE_BUFFERS, 'buffer', None)
+    if buffer is None:
+        buffer = _ENCODE_BUFFERS.buffer = io.BytesIO()
+    buffer.seek(0)
+    img.save(buffer, *args, **kwargs)
+    # Never truncated, so it keeps the largest size seen; only the first n bytes are this image
+    n = buffer.tell()
+    with buffer.getbuffer() as view:
+        f.write(view[:n])
+
+def encode_with_vips(img, output_format, png_optimize=False):
+    """Encode an 8-bit L/LA/RGB/RGBA image with libvips"""
+    vimg = pyvips.Image.new_from_memory(img.tobytes(), img.width, img.height, _VIPS_BANDS[img.mode], 'uchar')
+    if output_format == 'jpeg':
+        # Match Pillow's output: 4:2:0 chroma even at high quality, optimized Huffman tables
+        return vimg.jpegsave_buffer(Q=95, optimize_coding=True, subsample_mode='on', strip=True)
+    return vimg.pngsave_buffer(compression=9 if png_optimize else 1, strip=True)
+
+def with_icc_profile(jpeg_data, icc_profile):
+    """Insert an ICC profile into encoded JPEG data as APP2 ICC_PROFILE segments"""
+    if not icc_profile:
+        return jpeg_data
+    chunks = [icc_profile[i:i + 65519] for i in range(0, len(icc_profile), 65519)]
+    segments = b''.join(
+        b'\xff\xe2' + (len(chunk) + 16).to_bytes(2, 'big') + b'ICC_PROFILE\0' + bytes((seq, len(chunks))) + chunk
+        for seq, chunk in enumerate(chunks, 1)
+    )
+    # Right after SOI, or after the JFIF APP0 segment if there is one
+    pos = 2
+    if jpeg_data[2:4] == b'\xff\xe0':
+        pos = 4 + int.from_bytes(jpeg_data[4:6], 'big')
+    return jpeg_data[:pos] + segments + jpeg_data[pos:]
+
+def with_png_icc_profile(png_data, icc_profile):
+    """Insert an ICC profile into encoded PNG data as an iCCP chunk"""
+    if not icc_profile:
+        return png_data
+    body = b'iCCP' + b'ICC Profile\0\0' + zlib.compress(icc_profile)
+    chunk = (len(body) - 4).to_bytes(4, 'big') + body + zlib.crc32(body).to_bytes(4, 'big')
+    # iCCP must come before PLTE and IDAT; IHDR is always first and ends 33 bytes in
+    return png_data[:33] + chunk + png_data[33:]
+
+def strip_jpeg_lossless(jpeg_data):
+    """Rewrite a JPEG without its metadata via a lossless libjpeg-turbo transform
+    
+    The ICC profile is kept. Returns None if the data is not a JPEG libjpeg-turbo
+    can transform, or if its EXIF orientation means the pixels must be rotated.
+    """
+    try:
+        with Image.open(io.BytesIO(jpeg_data)) as img:
+            if img.getexif().get(ExifTags.Base.Orientation, 1) != 1:
+                return None
+            icc_profile = img.info.get('icc_profile')
+        width, height, _, _ = _TJ.decode_header(jpeg_data)
+        # A crop covering the whole frame is an identity transform; copynone strips every marker
+        return with_icc_profile(_TJ.crop(jpeg_data, 0, 0, width, height, copynone=True), icc_profile)
+    except OSError:
+        return None
+
+@contextlib.contextmanager
+def write_output(output_path):
+    """Open a file that only appears at output_path once the block completes
+    
+    Uses an unnamed O_TMPFILE inode linked into place on success, so a failed
+    encode leaves nothing behind; elsewhere, a .part file renamed over it.
+    """
+    fd = None
+    if hasattr(os, 'O_TMPFILE'):
+        folder, name = os.path.split(output_path)
+        dir_fd = os.open(folder or '.', os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            fd = os.open('.', os.O_TMPFILE | os.O_WRONLY, 0o644, dir_fd=dir_fd)
+        except OSError:
+            # Filesystem without O_TMPFILE support
+            os.close(dir_fd)
+    
+    if fd is not None:
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                yield f
+                f.flush()
+                # Passing a dir_fd makes os.link use linkat(AT_SYMLINK_FOLLOW),
+                # which resolves the /proc magic link to the unnamed inode
+                os.link(f'/proc/self/fd/{fd}', name, dst_dir_fd=dir_fd)
+        finally:
+            os.close(dir_fd)
+        return
+    
+    part_path = output_path + '.part'
     try:
-        input_format = get_file_format(input_path)
+        with open(part_path, 'wb') as f:
+            yield f
+        os.replace(part_path, output_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+def convert_image(fp, input_format, output_format, png_optimize=False, max_dim=None):
+    """Convert image to specified format with HEIC support
+    
+    fp is a seekable file object, or a path on disk for the imageio HEIC reader.
+    PNG output uses fast zlib compression unless png_optimize is set; unlike
+    JPEG's optimize flag, PNG's runs the slowest compressor settings.
+    max_dim, if given, bounds the longest side of the output.
+    """
+    try:
+        # Create output filename
+        unique_id = secrets.token_hex(4)
+        output_filename = f"converted_{unique_id}.{output_format.lower()}"
+        output_path = os.path.join(CONVERTED_FOLDER, output_filename)
+        
+        # JPEG to JPEG: drop metadata losslessly instead of decoding and re-encoding
+        if input_format in ['jpg', 'jpeg'] and output_format.lower() == 'jpeg' and _TJ is not None and not max_dim:
+            jpeg_data = strip_jpeg_lossless(fp.read())
+            if jpeg_data is not None:
+                with write_output(output_path) as f:
+                    f.write(jpeg_data)
+                return output_path, output_filename
+            fp.seek(0)
         
         # Handle HEIC/HEIF files
         if input_format in ['heic', 'heif']:
             if HEIC_SUPPORT_METHOD == "pillow-heif":
                 # Use pillow-heif (best method)
-                img = Image.open(input_path)
+                img = Image.open(fp)
             elif HEIC_SUPPORT_METHOD == "imageio":
                 # Use imageio as fallback
-                img = convert_heic_with_imageio(input_path)
+                img = convert_heic_with_imageio(fp)
             else:
                 raise Exception("HEIC support not available. Please install pillow-heif or imageio")
         else:
             # Regular image formats
-            img = Image.open(input_path)
+            img = Image.open(fp)
+        
+        if max_dim:
+            # Lets libjpeg scale during decode (IDCT scaling) before the resize
+            img.draft('RGB', (max_dim, max_dim))
+        
+        # Decode once up front, then release the upload buffer
+        img.load()
+        if not isinstance(fp, str):
+            fp.close()
+        icc_profile = img.info.get('icc_profile')
+        
+        if input_format in ['jpg', 'jpeg']:
+            # The output carries no EXIF, so bake the orientation into the pixels
+            ImageOps.exif_transpose(img, in_place=True)
+        
+        if max_dim:
+            img.thumbnail((max_dim, max_dim), Image.BILINEAR)
         
         # Convert to RGB if necessary (for JPEG)
-        if output_format.lower() == 'jpeg' and img.mode in ('RGBA', 'LA', 'P'):
+        if output_format.lower() == 'jpeg' and img.mode == 'P' and 'transparency' not in img.info:
+            # Opaque palette image: expand straight to RGB, there is nothing to blend
+            img = img.convert('RGB')
+        elif output_format.lower() == 'jpeg' and img.mode in ('RGBA', 'LA', 'P'):
             # Create white background for transparent images
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            if img.mode == 'RGBA':
-                background.paste(img, mask=img.split()[-1])
-            else:
-                background.paste(img)
-            img = background
-        
-        # Create output filename
-        unique_id = str(uuid.uuid4())[:8]
-        output_filename = f"converted_{unique_id}.{output_format.lower()}"
-        output_path = os.path.join(CONVERTED_FOLDER, output_filename)
+            img = flatten_alpha(img)
         
         # Save with high quality
-        if output_format.lower() == 'jpeg':
-            img.save(output_path, 'JPEG', quality=95, optimize=True)
-        else:  # PNG
-            img.save(output_path, 'PNG', optimize=True)
+        with write_output(output_path) as f:
+            if output_format.lower() == 'jpeg':
+                if _TJ is not None and img.mode in ('RGB', 'L'):
+                    f.write(with_icc_profile(encode_jpeg_turbo(img), icc_profile))
+                elif pyvips is not None and img.mode in ('RGB', 'L'):
+                    f.write(with_icc_profile(encode_with_vips(img, 'jpeg'), icc_profile))
+                else:
+                    encode_with_pillow(img, f, 'JPEG', quality=95, optimize=True, icc_profile=icc_profile)
+            elif pyvips is not None and img.mode in _VIPS_BANDS:
+                f.write(with_png_icc_profile(encode_with_vips(img, 'png', png_optimize), icc_profile))
+            elif png_optimize:
+                encode_with_pillow(img, f, 'PNG', optimize=True)
+            else:  # PNG
+                encode_with_pillow(img, f, 'PNG', compress_level=1)
         
         return output_path, output_filename
             
     except Exception as e:
         raise Exception(f"Conversion failed: {str(e)}")
 
-@app.route('/')
-def index():
-    if 'conversion_history' not in session:
-        session['conversion_history'] = []
+def convert_one(task):
+    """Convert one upload in a pool worker, returning (file_info, error)
+    
+    Module-level and driven by a plain tuple so it can be pickled to worker
+    processes. The source is the upload's bytes or a path in UPLOAD_FOLDER,
+    which is removed when done.
+    """
+    filename, source, input_format, output_format, png_optimize, max_dim = task
+    try:
+        if isinstance(source, bytes):
+            output_path, output_filename = convert_image(io.BytesIO(source), input_format, output_format, png_optimize, max_dim)
+        elif input_format in ['heic', 'heif'] and HEIC_SUPPORT_METHOD == "imageio":
+            # imageio reads from the path itself
+            output_path, output_filename = convert_image(source, input_format, output_format, png_optimize, max_dim)
+        else:
+            with open(source, 'rb') as fp:
+                output_path, output_filename = convert_image(fp, input_format, output_format, png_optimize, max_dim)
+        return {
+            'original_name': filename,
+            'converted_name': output_filename,
+            'path': output_path,
+            'size': os.path.getsize(output_path)
+        }, None
+    except Exception as e:
+        return None, f"{filename}: {str(e)}"
+    finally:
+        # Clean up temp file
+        if isinstance(source, str) and os.path.exists(source):
+            os.remove(source)
+
+def cache_key(source, output_format, png_optimize, max_dim, digest=None):
+    """Cache file name for converting this content (bytes or a path) with these options
+    
+    digest is the content's hash if it was taken while the upload streamed in;
+    otherwise the content is hashed here.
+    """
+    if digest is None:
+        hasher = content_hasher()
+        if isinstance(source, bytes):
+            hasher.update(source)
+        else:
+            with open(source, 'rb') as fp:
+                while chunk := fp.read(UPLOAD_CHUNK_SIZE):
+                    hasher.update(chunk)
+        digest = hasher.hexdigest()
+    options = f"{'max' if png_optimize else 'fast'}_{max_dim or 'full'}"
+    return f"cache_{digest}_{options}.{output_format}"
+
+def cached_result(key, filename, output_format):
+    """Hard-link a cached conversion to a fresh output name; None on a miss"""
+    with _RESULT_CACHE_LOCK:
+        entry = _RESULT_CACHE.get(key)
+    if entry is None:
+        return None
+    
+    output_filename = f"converted_{secrets.token_hex(4)}.{output_format}"
+    output_path = os.path.join(CONVERTED_FOLDER, output_filename)
+    try:
+        os.link(entry[0], output_path)
+    except OSError:
+        with _RESULT_CACHE_LOCK:
+            _RESULT_CACHE.pop(key, None)
+        return None
+    
+    return {
+        'original_name': filename,
+        'converted_name': output_filename,
+        'path': output_path,
+        'size': entry[1]
+    }
+
+def cache_result(key, output_path):
+    """Keep a hard link to a fresh conversion under its cache key"""
+    cache_path = os.path.join(CONVERTED_FOLDER, key)
+    try:
+        os.link(output_path, cache_path)
+    except FileExistsError:
+        # Same content converted concurrently, or left over from a previous run
+        pass
+    except OSError:
+        return
+    
+    with _RESULT_CACHE_LOCK:
+        try:
+            _RESULT_CACHE[key] = (cache_path, os.path.getsize(cache_path))
+        except ValueError:
+            # Larger than the whole cache
+            os.remove(cache_path)
+
+def get_convert_pool():
+    """Process pool shared by all requests, created on first use"""
+    global _CONVERT_POOL
+    with _CONVERT_POOL_LOCK:
+        if _CONVERT_POOL is None:
+            # Numba's parallel kernel leaves worker threads running, and a forked
+            # child hangs on exit without them, so start from a clean interpreter
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            _CONVERT_POOL = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=context)
+        return _CONVERT_POOL
+
+def reset_convert_pool():
+    """Drop a pool whose worker died so the next request starts a fresh one"""
+    global _CONVERT_POOL
+    with _CONVERT_POOL_LOCK:
+        if _CONVERT_POOL is not None:
+            _CONVERT_POOL.shutdown(wait=False)
+            _CONVERT_POOL = None
+
+def schedule_expiry(*paths):
+    """Queue files for deletion once FILE_TTL has passed, starting the janitor on first use"""
+    global _JANITOR
+    expires = time.monotonic() + FILE_TTL
+    with _EXPIRY_COND:
+        for path in paths:
+            heapq.heappush(_EXPIRY_HEAP, (expires, path))
+        if _JANITOR is None:
+            _JANITOR = threading.Thread(target=expiry_janitor, name='expiry-janitor', daemon=True)
+            _JANITOR.start()
+        _EXPIRY_COND.notify()
+
+def expiry_janitor():
+    """Sleep until the earliest expiry, then delete everything that is due"""
+    # Files left behind by a previous run were never scheduled
+    cleanup_temp_files()
+    while True:
+        with _EXPIRY_COND:
+            while not _EXPIRY_HEAP or _EXPIRY_HEAP[0][0] > time.monotonic():
+                _EXPIRY_COND.wait(_EXPIRY_HEAP[0][0] - time.monotonic() if _EXPIRY_HEAP else None)
+            now = time.monotonic()
+            due = []
+            while _EXPIRY_HEAP and _EXPIRY_HEAP[0][0] <= now:
+                due.append(heapq.heappop(_EXPIRY_HEAP)[1])
+        
+        unlink_batch(due)
+
+def unlink_batch(paths):
+    """Delete files, opening each parent directory once and unlinking relative to it"""
+    by_folder = {}
+    for path in paths:
+        folder, name = os.path.split(path)
+        by_folder.setdefault(folder or '.', []).append(name)
+    
+    for folder, names in by_folder.items():
+        dir_fd = None
+        if os.unlink in os.supports_dir_fd:
+            try:
+                dir_fd = os.open(folder, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+            except OSError:
+                pass
+        try:
+            for name in names:
+                try:
+                    if dir_fd is None:
+                        os.unlink(os.path.join(folder, name))
+                    else:
+                        os.unlink(name, dir_fd=dir_fd)
+                except OSError:
+                    pass
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+
+class ChunkSink:
+    """Write-only, unseekable file object that collects bytes until drained
+    
+    ZipFile falls back to data descriptors when it cannot seek, so an archive
+    written here can be yielded to the client piece by piece.
+    """
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_archive(entries):
+    """Yield a stored zip of (fd, name, stat) entries without building it in memory
+    
+    Each file is read from its already open descriptor into one reused buffer.
+    """
+    sink = ChunkSink()
+    buf = bytearray(ARCHIVE_CHUNK_SIZE)
+    view = memoryview(buf)
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zipf:
+        for fd, name, st in entries:
+            # Same fields ZipInfo.from_file takes from a path; the size is known
+            # up front, so Zip64 is only used when needed
+            info = zipfile.ZipInfo(name, time.localtime(st.st_mtime)[:6])
+            info.file_size = st.st_size
+            info.external_attr = (st.st_mode & 0xFFFF) << 16
+            if hasattr(os, 'posix_fadvise'):
+                # Let the kernel read ahead aggressively; the file is read once, front to back
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            with io.FileIO(fd, closefd=False) as src, zipf.open(info, 'w') as dst:
+                while n := src.readinto(buf):
+                    dst.write(view[:n])
+                    yield sink.drain()
+    # Central directory
+    yield sink.drain()
+
+def timestamps():
+    """Local time as ('YYYY-MM-DD HH:MM:SS', 'YYYYMMDD_HHMMSS'), formatted once per second"""
+    global _TIMESTAMPS
+    now = int(time.time())
+    cached = _TIMESTAMPS
+    if cached[0] != now:
+        tm = time.localtime(now)
+        display = f"{tm.tm_year:04d}-{tm.tm_mon:02d}-{tm.tm_mday:02d} {tm.tm_hour:02d}:{tm.tm_min:02d}:{tm.tm_sec:02d}"
+        compact = f"{tm.tm_year:04d}{tm.tm_mon:02d}{tm.tm_mday:02d}_{tm.tm_hour:02d}{tm.tm_min:02d}{tm.tm_sec:02d}"
+        # Replaced as a single tuple, so concurrent readers never see a mix
+        cached = _TIMESTAMPS = (now, display, compact)
+    return cached[1], cached[2]
+
+def record_history(entry):
+    """Append a history entry for the current session"""
+    if 'sid' not in session:
+        session['sid'] = secrets.token_urlsafe(16)
+    sid = session['sid']
     
+    with _HISTORY_LOCK:
+        history = _HISTORY.get(sid)
+        if history is None:
+            history = collections.deque(maxlen=_HISTORY_PER_SESSION)
+        history.append(entry)
+        # Reassign so the session's TTL restarts
+        _HISTORY[sid] = history
+
+def session_history():
+    """History entries for the current session, oldest first"""
+    sid = session.get('sid')
+    with _HISTORY_LOCK:
+        return list(_HISTORY.get(sid, ()))
+
+def clear_session_history():
+    """Drop the current session's history"""
+    with _HISTORY_LOCK:
+        _HISTORY.pop(session.get('sid'), None)
+
+def render_index_html():
+    """Build the single-page UI; HEIC support is fixed at import, so this runs once"""
     # Dynamic support message
     if HEIC_SUPPORT_METHOD:
         support_message = f"✅ HEIC/HEIF support enabled via {HEIC_SUPPORT_METHOD}! Also supports: JPG, PNG, BMP, GIF, TIFF, WebP"
@@ -146,370 +837,9 @@ def index():
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>{"HEIC " if HEIC_SUPPORT_METHOD else ""}Image Converter</title>
-    <style>
-        * {{
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }}
-        
-        body {{
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            min-height: 100vh;
-            padding: 20px;
-        }}
-        
-        .container {{
-            max-width: 800px;
-            margin: 0 auto;
-            background: white;
-            border-radius: 20px;
-            box-shadow: 0 20px 40px rgba(0,0,0,0.1);
-            overflow: hidden;
-        }}
-        
-        .header {{
-            background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%);
-            color: white;
-            padding: 30px;
-            text-align: center;
-        }}
-        
-        .header h1 {{
-            font-size: 2.5rem;
-            margin-bottom: 10px;
-            font-weight: 300;
-        }}
-        
-        .header p {{
-            font-size: 1.1rem;
-            opacity: 0.9;
-        }}
-        
-        .notice {{
-            background: {"#d4edda" if status_class == "success" else "#fff3cd"};
-            border: 1px solid {"#c3e6cb" if status_class == "success" else "#ffeaa7"};
-            color: {"#155724" if status_class == "success" else "#856404"};
-            padding: 15px;
-            margin: 20px;
-            border-radius: 10px;
-        }}
-        
-        .notice.success {{
-            background: #d4edda;
-            border-color: #c3e6cb;
-            color: #155724;
-        }}
-        
-        .notice.warning {{
-            background: #fff3cd;
-            border-color: #ffeaa7;
-            color: #856404;
-        }}
-        
-        .main-content {{
-            padding: 40px;
-        }}
-        
-        .upload-section {{
-            background: #f8f9fa;
-            border: 3px dashed #dee2e6;
-            border-radius: 15px;
-            padding: 40px;
-            text-align: center;
-            transition: all 0.3s ease;
-            cursor: pointer;
-            margin-bottom: 30px;
-        }}
-        
-        .upload-section:hover {{
-            border-color: #4facfe;
-            background: #e3f2fd;
-        }}
-        
-        .upload-section.dragover {{
-            border-color: #4facfe;
-            background: #e3f2fd;
-            transform: scale(1.02);
-        }}
-        
-        .upload-icon {{
-            font-size: 4rem;
-            color: #6c757d;
-            margin-bottom: 20px;
-        }}
-        
-        .upload-text {{
-            font-size: 1.2rem;
-            color: #495057;
-            margin-bottom: 10px;
-        }}
-        
-        .upload-subtext {{
-            font-size: 0.9rem;
-            color: #6c757d;
-            margin-bottom: 20px;
-        }}
-        
-        .file-input {{
-            display: none;
-        }}
-        
-        .btn {{
-            padding: 12px 30px;
-            border: none;
-            border-radius: 25px;
-            cursor: pointer;
-            font-size: 1rem;
-            font-weight: 500;
-            transition: all 0.3s ease;
-            text-transform: uppercase;
-            letter-spacing: 1px;
-        }}
-        
-        .btn-primary {{
-            background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%);
-            color: white;
-        }}
-        
-        .btn-primary:hover {{
-            transform: translateY(-2px);
-            box-shadow: 0 10px 20px rgba(79, 172, 254, 0.3);
-        }}
-        
-        .btn-success {{
-            background: linear-gradient(135deg, #56ab2f 0%, #a8e6cf 100%);
-            color: white;
-        }}
-        
-        .btn-success:hover {{
-            transform: translateY(-2px);
-            box-shadow: 0 10px 20px rgba(86, 171, 47, 0.3);
-        }}
-        
-        .format-selection {{
-            margin: 30px 0;
-            text-align: center;
-        }}
-        
-        .format-selection h3 {{
-            margin-bottom: 20px;
-            color: #495057;
-        }}
-        
-        .format-options {{
-            display: flex;
-            gap: 20px;
-            justify-content: center;
-        }}
-        
-        .format-option {{
-            position: relative;
-        }}
-        
-        .format-option input[type="radio"] {{
-            display: none;
-        }}
-        
-        .format-label {{
-            display: block;
-            padding: 15px 30px;
-            background: #f8f9fa;
-            border: 2px solid #dee2e6;
-            border-radius: 25px;
-            cursor: pointer;
-            transition: all 0.3s ease;
-            font-weight: 500;
-            text-transform: uppercase;
-            letter-spacing: 1px;
-        }}
-        
-        .format-option input[type="radio"]:checked + .format-label {{
-            background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%);
-            color: white;
-            border-color: #4facfe;
-            transform: translateY(-2px);
-            box-shadow: 0 10px 20px rgba(79, 172, 254, 0.3);
-        }}
-        
-        .selected-files {{
-            margin: 20px 0;
-        }}
-        
-        .file-list {{
-            background: #f8f9fa;
-            border-radius: 10px;
-            padding: 20px;
-            margin-top: 15px;
-        }}
-        
-        .file-item {{
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            padding: 10px;
-            background: white;
-            border-radius: 8px;
-            margin-bottom: 10px;
-            box-shadow: 0 2px 5px rgba(0,0,0,0.1);
-        }}
-        
-        .file-item:last-child {{
-            margin-bottom: 0;
-        }}
-        
-        .file-info {{
-            flex: 1;
-        }}
-        
-        .file-name {{
-            font-weight: 500;
-            color: #495057;
-        }}
-        
-        .file-size {{
-            font-size: 0.8rem;
-            color: #6c757d;
-        }}
-        
-        .convert-section {{
-            text-align: center;
-            margin-top: 30px;
-        }}
-        
-        .result-section {{
-            margin-top: 30px;
-            padding: 20px;
-            background: #f8f9fa;
-            border-radius: 15px;
-            display: none;
-        }}
-        
-        .success-message {{
-            color: #28a745;
-            margin-bottom: 15px;
-        }}
-        
-        .error-message {{
-            color: #dc3545;
-            margin-bottom: 15px;
-        }}
-        
-        .history-section {{
-            margin-top: 40px;
-            padding: 30px;
-            background: #f8f9fa;
-            border-radius: 15px;
-        }}
-        
-        .history-header {{
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 20px;
-        }}
-        
-        .history-header h3 {{
-            color: #495057;
-        }}
-        
-        .btn-outline {{
-            background: transparent;
-            border: 2px solid #dee2e6;
-            color: #6c757d;
-            padding: 8px 20px;
-            font-size: 0.9rem;
-        }}
-        
-        .btn-outline:hover {{
-            border-color: #4facfe;
-            color: #4facfe;
-        }}
-        
-        .history-list {{
-            max-height: 300px;
-            overflow-y: auto;
-        }}
-        
-        .history-item {{
-            background: white;
-            border-radius: 10px;
-            padding: 15px;
-            margin-bottom: 10px;
-            box-shadow: 0 2px 5px rgba(0,0,0,0.1);
-        }}
-        
-        .history-time {{
-            font-size: 0.9rem;
-            color: #6c757d;
-            margin-bottom: 5px;
-        }}
-        
-        .history-details {{
-            color: #495057;
-            font-weight: 500;
-        }}
-        
-        .history-files {{
-            font-size: 0.8rem;
-            color: #6c757d;
-            margin-top: 5px;
-        }}
-        
-        .loading {{
-            display: none;
-            text-align: center;
-            padding: 20px;
-        }}
-        
-        .spinner {{
-            border: 4px solid #f3f3f3;
-            border-top: 4px solid #4facfe;
-            border-radius: 50%;
-            width: 40px;
-            height: 40px;
-            animation: spin 1s linear infinite;
-            margin: 0 auto 10px;
-        }}
-        
-        @keyframes spin {{
-            0% {{ transform: rotate(0deg); }}
-            100% {{ transform: rotate(360deg); }}
-        }}
-        
-        .empty-state {{
-            text-align: center;
-            padding: 40px;
-            color: #6c757d;
-        }}
-        
-        @media (max-width: 768px) {{
-            .container {{
-                margin: 10px;
-                border-radius: 15px;
-            }}
-            
-            .header h1 {{
-                font-size: 2rem;
-            }}
-            
-            .main-content {{
-                padding: 20px;
-            }}
-            
-            .format-options {{
-                flex-direction: column;
-                align-items: center;
-            }}
-            
-            .format-label {{
-                width: 200px;
-            }}
-        }}
-    </style>
+    <link rel="stylesheet" href="/static/app.css">
 </head>
-<body>
+<body data-formats="{"HEIC, HEIF, " if HEIC_SUPPORT_METHOD else ""}JPG, PNG, BMP, GIF, TIFF, WebP">
     <div class="container">
         <div class="header">
             <h1>🖼️ {"HEIC " if HEIC_SUPPORT_METHOD else ""}Image Converter</h1>
@@ -585,356 +915,300 @@ def index():
         </div>
     </div>
 
-    <script>
-        let selectedFiles = [];
-        
-        // File input change event
-        document.getElementById('fileInput').addEventListener('change', handleFileSelect);
-        
-        // Drag and drop functionality
-        const uploadSection = document.querySelector('.upload-section');
-        
-        uploadSection.addEventListener('dragover', (e) => {{
-            e.preventDefault();
-            uploadSection.classList.add('dragover');
-        }});
-        
-        uploadSection.addEventListener('dragleave', () => {{
-            uploadSection.classList.remove('dragover');
-        }});
-        
-        uploadSection.addEventListener('drop', (e) => {{
-            e.preventDefault();
-            uploadSection.classList.remove('dragover');
-            const files = e.dataTransfer.files;
-            handleFiles(files);
-        }});
-        
-        function handleFileSelect(e) {{
-            handleFiles(e.target.files);
-        }}
-        
-        function handleFiles(files) {{
-            selectedFiles = Array.from(files).filter(file => {{
-                const ext = file.name.split('.').pop().toLowerCase();
-                return ['heic', 'heif', 'jpg', 'jpeg', 'png', 'bmp', 'gif', 'tiff', 'webp'].includes(ext);
-            }});
-            
-            if (selectedFiles.length === 0) {{
-                alert('Please select supported image files ({"HEIC, HEIF, " if HEIC_SUPPORT_METHOD else ""}JPG, PNG, BMP, GIF, TIFF, WebP).');
-                return;
-            }}
-            
-            displaySelectedFiles();
-            document.getElementById('convertBtn').style.display = 'inline-block';
-        }}
-        
-        function displaySelectedFiles() {{
-            const fileList = document.getElementById('fileList');
-            const selectedFilesDiv = document.getElementById('selectedFiles');
-            
-            fileList.innerHTML = '';
-            
-            selectedFiles.forEach((file, index) => {{
-                const fileItem = document.createElement('div');
-                fileItem.className = 'file-item';
-                fileItem.innerHTML = `
-                    <div class="file-info">
-                        <div class="file-name">${{file.name}}</div>
-                        <div class="file-size">${{formatFileSize(file.size)}}</div>
-                    </div>
-                `;
-                fileList.appendChild(fileItem);
-            }});
-            
-            selectedFilesDiv.style.display = 'block';
-        }}
-        
-        function formatFileSize(bytes) {{
-            if (bytes === 0) return '0 Bytes';
-            const k = 1024;
-            const sizes = ['Bytes', 'KB', 'MB', 'GB'];
-            const i = Math.floor(Math.log(bytes) / Math.log(k));
-            return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + ' ' + sizes[i];
-        }}
-        
-        async function convertFiles() {{
-            if (selectedFiles.length === 0) {{
-                alert('Please select files first.');
-                return;
-            }}
-            
-            const format = document.querySelector('input[name="format"]:checked').value;
-            const formData = new FormData();
-            
-            selectedFiles.forEach(file => {{
-                formData.append('files', file);
-            }});
-            formData.append('format', format);
-            
-            // Show loading
-            document.getElementById('loading').style.display = 'block';
-            document.getElementById('resultSection').style.display = 'none';
-            document.getElementById('convertBtn').disabled = true;
+    <script src="/static/app.js"></script>
+</body>
+</html>
+    '''
+
+_INDEX_HTML = render_index_html().encode('utf-8')
+_INDEX_GZ = gzip.compress(_INDEX_HTML, 9)
+_INDEX_ETAG = hashlib.sha1(_INDEX_HTML).hexdigest()
+
+@app.route('/')
+def index():
+    headers = {'Cache-Control': 'public, max-age=300', 'Vary': 'Accept-Encoding'}
+    if request.accept_encodings['gzip']:
+        headers['Content-Encoding'] = 'gzip'
+        response = Response(_INDEX_GZ, mimetype='text/html', direct_passthrough=True, headers=headers)
+        response.set_etag(f"{_INDEX_ETAG}-gzip")
+    else:
+        response = Response(_INDEX_HTML, mimetype='text/html', direct_passthrough=True, headers=headers)
+        response.set_etag(_INDEX_ETAG)
+    
+    # Answers If-None-Match revalidation with an empty 304
+    return response.make_conditional(request)
+
+def run_conversions(uploads, output_format, png_optimize=False, max_dim=None, errors=None):
+    """Validate and convert (name, stream, temp_path, digest) uploads, returning the JSON response
+    
+    Each upload has either a stream to read or a temp_path already on disk.
+    digest is the content hash of a temp_path if one was taken as it was written.
+    errors carries problems found before conversion, to report alongside.
+    """
+    converted_files = []
+    errors = list(errors or [])
+    tasks = []
+    slots = []  # (cache key, file_info if cached) per accepted upload, in order
+    
+    # Keep uploads in memory unless the request is big enough to matter
+    spill = request.content_length is None or request.content_length > SPILL_THRESHOLD
+    
+    for name, stream, temp_path, digest in uploads:
+        if name == '':
+            continue
             
-            try {{
-                const response = await fetch('/convert', {{
-                    method: 'POST',
-                    body: formData
-                }});
-                
-                const result = await response.json();
-                
-                // Hide loading
-                document.getElementById('loading').style.display = 'none';
-                document.getElementById('convertBtn').disabled = false;
-                
-                if (result.success) {{
-                    showResult(result);
-                    loadHistory(); // Reload history
-                    
-                    // Reset form
-                    selectedFiles = [];
-                    document.getElementById('fileInput').value = '';
-                    document.getElementById('selectedFiles').style.display = 'none';
-                    document.getElementById('convertBtn').style.display = 'none';
-                }} else {{
-                    showError(result.error, result.details);
-                }}
-                
-            }} catch (error) {{
-                document.getElementById('loading').style.display = 'none';
-                document.getElementById('convertBtn').disabled = false;
-                showError('Network error: ' + error.message);
-            }}
-        }}
+        filename = secure_filename(name)
         
-        function showResult(result) {{
-            const resultSection = document.getElementById('resultSection');
-            const resultMessage = document.getElementById('resultMessage');
-            
-            let message = `
-                <div class="success-message">
-                    <h4>✅ Conversion Successful!</h4>
-                    <p>Your ${{result.single_file ? 'image has' : 'images have'}} been converted successfully.</p>
-                </div>
-            `;
-            
-            if (result.errors && result.errors.length > 0) {{
-                message += `
-                    <div class="error-message">
-                        <h5>⚠️ Some files had issues:</h5>
-                        <ul>
-                            ${{result.errors.map(error => `<li>${{error}}</li>`).join('')}}
-                        </ul>
-                    </div>
-                `;
-            }}
+        if temp_path is not None and not os.path.exists(temp_path):
+            errors.append(f"{filename}: Upload not found")
+            continue
+        try:
+            if temp_path is None and spill:
+                # Save uploaded file temporarily; the size cap is enforced while copying
+                unique_id = secrets.token_hex(4)
+                temp_filename = f"temp_{unique_id}_{filename}"
+                temp_path = os.path.join(UPLOAD_FOLDER, temp_filename)
+                digest = save_upload(stream, temp_path)
+                if digest is None:
+                    errors.append(f"{filename}: File too large (max 16MB)")
+                    continue
             
-            message += `
-                <div style="margin-top: 20px;">
-                    <a href="${{result.download_url}}" class="btn btn-success" download>
-                        📥 Download ${{result.single_file ? 'Image' : 'Archive'}}
-                    </a>
-                </div>
-            `;
+            if temp_path is None:
+                source = read_upload(stream)
+                if source is None:
+                    errors.append(f"{filename}: File too large (max 16MB)")
+                    continue
+                # Trust the content over the name; some phones save HEIC as .jpg
+                input_format = _sniff(io.BytesIO(source)) or _ext(filename)
+            else:
+                source = temp_path
+                with open(temp_path, 'rb') as fp:
+                    input_format = _sniff(fp) or _ext(filename)
             
-            resultMessage.innerHTML = message;
-            resultSection.style.display = 'block';
-        }}
-        
-        function showError(error, details = null) {{
-            const resultSection = document.getElementById('resultSection');
-            const resultMessage = document.getElementById('resultMessage');
+            # Check if file is allowed
+            if input_format not in ALLOWED_EXTENSIONS:
+                errors.append(f"{filename}: Unsupported file format")
+                if temp_path:
+                    os.remove(temp_path)
+                continue
             
-            let message = `
-                <div class="error-message">
-                    <h4>❌ Conversion Failed</h4>
-                    <p>${{error}}</p>
-                </div>
-            `;
+            # Check if trying to convert to same format
+            if (input_format, output_format) in _SAME_FORMAT:
+                errors.append(f"{filename}: File is already in {output_format.upper()} format")
+                if temp_path:
+                    os.remove(temp_path)
+                continue
             
-            if (details && details.length > 0) {{
-                message += `
-                    <div class="error-message">
-                        <h5>Details:</h5>
-                        <ul>
-                            ${{details.map(detail => `<li>${{detail}}</li>`).join('')}}
-                        </ul>
-                    </div>
-                `;
-            }}
+            # Identical content already converted with the same options
+            key = cache_key(source, output_format, png_optimize, max_dim, digest)
+            file_info = cached_result(key, filename, output_format)
+            if file_info is not None:
+                slots.append((key, file_info))
+                if temp_path:
+                    os.remove(temp_path)
+                continue
             
-            resultMessage.innerHTML = message;
-            resultSection.style.display = 'block';
-        }}
-        
-        async function loadHistory() {{
-            try {{
-                const response = await fetch('/history');
-                const data = await response.json();
-                displayHistory(data.history);
-            }} catch (error) {{
-                console.error('Failed to load history:', error);
-            }}
-        }}
-        
-        function displayHistory(history) {{
-            const historyList = document.getElementById('historyList');
+            if temp_path is None and input_format in ['heic', 'heif'] and HEIC_SUPPORT_METHOD == "imageio":
+                # imageio reads from a path, so spill this one to disk
+                unique_id = secrets.token_hex(4)
+                temp_filename = f"temp_{unique_id}_{filename}"
+                temp_path = os.path.join(UPLOAD_FOLDER, temp_filename)
+                with open(temp_path, 'wb') as out:
+                    out.write(source)
+                source = temp_path
             
-            if (history.length === 0) {{
-                historyList.innerHTML = `
-                    <div class="empty-state">
-                        <p>No conversion history yet. Convert some images to see your history here!</p>
-                    </div>
-                `;
-                return;
-            }}
+            slots.append((key, None))
+            tasks.append((filename, source, input_format, output_format, png_optimize, max_dim))
             
-            historyList.innerHTML = history.map(item => `
-                <div class="history-item">
-                    <div class="history-time">${{item.timestamp}}</div>
-                    <div class="history-details">
-                        Converted ${{item.files_count}} file${{item.files_count > 1 ? 's' : ''}} to ${{item.output_format}}
-                    </div>
-                    <div class="history-files">
-                        Files: ${{item.files.join(', ')}}
-                    </div>
-                </div>
-            `).join('');
-        }}
-        
-        async function clearHistory() {{
-            if (confirm('Are you sure you want to clear the conversion history?')) {{
-                try {{
-                    await fetch('/clear-history', {{ method: 'POST' }});
-                    loadHistory();
-                }} catch (error) {{
-                    alert('Failed to clear history');
-                }}
-            }}
-        }}
-        
-        // Load history on page load
-        document.addEventListener('DOMContentLoaded', loadHistory);
-    </script>
-</body>
-</html>
-    '''
+        except Exception as e:
+            errors.append(f"{filename}: {str(e)}")
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    # Convert in worker processes or threads; a single file is not worth the hand-off
+    try:
+        if len(tasks) == 1:
+            results = [convert_one(tasks[0])]
+        elif tasks and _THREAD_POOL is not None:
+            results = list(_THREAD_POOL.map(convert_one, tasks))
+        elif tasks:
+            try:
+                results = list(get_convert_pool().map(convert_one, tasks))
+            except BrokenProcessPool:
+                reset_convert_pool()
+                raise Exception("A conversion worker crashed, please try again")
+        else:
+            results = []
+    except BaseException:
+        # Sources a worker never got to are left for the janitor
+        schedule_expiry(*(task[1] for task in tasks if isinstance(task[1], str)))
+        raise
+    
+    results = iter(results)
+    for key, file_info in slots:
+        error = None
+        if file_info is None:
+            file_info, error = next(results)
+            if file_info:
+                cache_result(key, file_info['path'])
+        if error:
+            errors.append(error)
+        else:
+            converted_files.append(file_info)
+    
+    if not converted_files:
+        return jsonify({'error': 'No files could be converted', 'details': errors}), 400
+    
+    schedule_expiry(*(f['path'] for f in converted_files))
+    
+    # One clock read for both the history entry and the archive name
+    timestamp, file_stamp = timestamps()
+    
+    # Update conversion history
+    history_entry = {
+        'timestamp': timestamp,
+        'files_count': len(converted_files),
+        'output_format': output_format.upper(),
+        'files': [f['original_name'] for f in converted_files]
+    }
+    record_history(history_entry)
+    
+    # If single file, return direct download
+    if len(converted_files) == 1:
+        return jsonify({
+            'success': True,
+            'single_file': True,
+            'download_url': f"/download/{converted_files[0]['converted_name']}",
+            'filename': converted_files[0]['converted_name'],
+            'errors': errors if errors else None
+        })
+    
+    # Multiple files - zip them when the archive is downloaded
+    zip_filename = f"converted_images_{file_stamp}.zip"
+    archive_files = ','.join(f['converted_name'] for f in converted_files)
+    
+    return jsonify({
+        'success': True,
+        'single_file': False,
+        'download_url': f"/download-archive/{zip_filename}?files={archive_files}",
+        'filename': zip_filename,
+        'converted_count': len(converted_files),
+        'errors': errors if errors else None
+    })
+
+@app.route('/upload-raw', methods=['POST'])
+def upload_raw():
+    """Stream one raw request body straight into UPLOAD_FOLDER
+    
+    Skips the multipart parser and its spooled copy; the returned upload_id
+    is then passed to /convert as an upload_ids form field.
+    """
+    filename = secure_filename(unquote(request.headers.get('X-Filename', '')))
+    if not filename:
+        return jsonify({'error': 'No file uploaded'}), 400
+    
+    upload_id = f"raw_{secrets.token_hex(8)}_{filename}"
+    upload_path = os.path.join(UPLOAD_FOLDER, upload_id)
+    digest = save_upload(request.stream, upload_path)
+    if digest is None:
+        return jsonify({'error': f'{filename}: File too large (max 16MB)'}), 413
+    with _RAW_DIGESTS_LOCK:
+        _RAW_DIGESTS[upload_id] = digest
+    # Converting removes it; this catches uploads that are never converted
+    schedule_expiry(upload_path)
+    
+    return jsonify({'success': True, 'upload_id': upload_id})
 
 @app.route('/convert', methods=['POST'])
 def convert_files():
     try:
-        if 'files' not in request.files:
-            return jsonify({'error': 'No files uploaded'}), 400
-        
-        files = request.files.getlist('files')
-        output_format = request.form.get('format', 'png').lower()
+        if request.mimetype == 'application/octet-stream':
+            # Single file posted as the raw request body
+            filename = unquote(request.headers.get('X-Filename', ''))
+            if not filename:
+                return jsonify({'error': 'No files uploaded'}), 400
+            uploads = [(filename, request.stream, None, None)]
+            output_format = request.args.get('format', 'png').lower()
+        elif 'upload_ids' in request.form:
+            # Files already streamed to disk through /upload-raw
+            uploads = []
+            for upload_id in request.form.getlist('upload_ids'):
+                if upload_id != secure_filename(upload_id) or not upload_id.startswith('raw_'):
+                    return jsonify({'error': 'Invalid upload id'}), 400
+                with _RAW_DIGESTS_LOCK:
+                    digest = _RAW_DIGESTS.pop(upload_id, None)
+                uploads.append((upload_id.split('_', 2)[-1], None, os.path.join(UPLOAD_FOLDER, upload_id), digest))
+            output_format = request.form.get('format', 'png').lower()
+        else:
+            if 'files' not in request.files:
+                return jsonify({'error': 'No files uploaded'}), 400
+            
+            uploads = [(file.filename, file.stream, None, None) for file in request.files.getlist('files')]
+            output_format = request.form.get('format', 'png').lower()
         
-        if not files or all(file.filename == '' for file in files):
+        if not uploads or all(name == '' for name, _, _, _ in uploads):
             return jsonify({'error': 'No files selected'}), 400
         
         if output_format not in ['png', 'jpeg']:
             return jsonify({'error': 'Invalid output format'}), 400
         
-        converted_files = []
-        errors = []
+        # ?compress=max trades PNG encode speed for the smallest file
+        png_optimize = request.args.get('compress') == 'max'
         
-        for file in files:
-            if file.filename == '':
-                continue
-                
-            filename = secure_filename(file.filename)
-            
-            # Check file size
-            file.seek(0, os.SEEK_END)
-            file_size = file.tell()
-            file.seek(0)
-            
-            if file_size > MAX_FILE_SIZE:
-                errors.append(f"{filename}: File too large (max 16MB)")
-                continue
-            
-            # Check if file is allowed
-            if not allowed_file(filename):
-                errors.append(f"{filename}: Unsupported file format")
-                continue
-            
-            # Check if trying to convert to same format
-            input_format = get_file_format(filename)
-            if input_format and input_format.lower() in ['jpg', 'jpeg'] and output_format == 'jpeg':
-                errors.append(f"{filename}: File is already in JPEG format")
-                continue
-            elif input_format and input_format.lower() == 'png' and output_format == 'png':
-                errors.append(f"{filename}: File is already in PNG format")
-                continue
-            
-            try:
-                # Save uploaded file temporarily
-                unique_id = str(uuid.uuid4())[:8]
-                temp_filename = f"temp_{unique_id}_{filename}"
-                temp_path = os.path.join(UPLOAD_FOLDER, temp_filename)
-                file.save(temp_path)
-                
-                # Convert the image
-                output_path, output_filename = convert_image(temp_path, output_format)
-                
-                # Add to converted files list
-                converted_files.append({
-                    'original_name': filename,
-                    'converted_name': output_filename,
-                    'path': output_path,
-                    'size': os.path.getsize(output_path)
-                })
-                
-                # Clean up temp file
-                os.remove(temp_path)
-                
-            except Exception as e:
-                errors.append(f"{filename}: {str(e)}")
-        
-        if not converted_files:
-            return jsonify({'error': 'No files could be converted', 'details': errors}), 400
+        # Optional bound on the longest side of the output, in pixels
+        max_dim = request.values.get('max_dim', '')
+        if max_dim:
+            # isdecimal() rules out signs and spaces; the length cap keeps int() in range
+            if not max_dim.isdecimal() or len(max_dim) > 6 or int(max_dim) == 0:
+                return jsonify({'error': 'Invalid max dimension'}), 400
+            max_dim = int(max_dim)
+        else:
+            max_dim = None
         
-        # Update conversion history
-        if 'conversion_history' not in session:
-            session['conversion_history'] = []
+        return run_conversions(uploads, output_format, png_optimize, max_dim)
         
-        history_entry = {
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'files_count': len(converted_files),
-            'output_format': output_format.upper(),
-            'files': [f['original_name'] for f in converted_files]
-        }
-        session['conversion_history'].append(history_entry)
-        session.modified = True
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+@app.route('/convert-batch', methods=['POST'])
+def convert_batch():
+    """Convert several files sent in one multipart/mixed request
+    
+    The first part is a JSON manifest, {"files": [{"name", "size"?, "sha256"?}],
+    "format"?, "compress"?, "max_dim"?}, followed by one part per listed file,
+    in order. Every part needs a Content-Disposition header.
+    """
+    try:
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype != 'multipart/mixed' or not boundary:
+            return jsonify({'error': 'Expected multipart/mixed with a boundary'}), 400
         
-        # If single file, return direct download
-        if len(converted_files) == 1:
-            return jsonify({
-                'success': True,
-                'single_file': True,
-                'download_url': f"/download/{converted_files[0]['converted_name']}",
-                'filename': converted_files[0]['converted_name'],
-                'errors': errors if errors else None
-            })
+        try:
+            manifest, uploads, errors = read_batch(request.stream, boundary.encode())
+        except ValueError as e:
+            return jsonify({'error': f'Invalid batch: {str(e)}'}), 400
         
-        # Multiple files - create zip
-        zip_filename = f"converted_images_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-        zip_path = os.path.join(CONVERTED_FOLDER, zip_filename)
+        output_format = str(manifest.get('format', 'png')).lower()
+        max_dim = manifest.get('max_dim')
+        error = None
+        if output_format not in ['png', 'jpeg']:
+            error = 'Invalid output format'
+        elif max_dim is not None and (type(max_dim) is not int or max_dim <= 0):
+            error = 'Invalid max dimension'
+        if error:
+            for _, _, temp_path, _ in uploads:
+                os.remove(temp_path)
+            return jsonify({'error': error}), 400
         
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for file_info in converted_files:
-                zipf.write(file_info['path'], file_info['converted_name'])
+        if not uploads:
+            return jsonify({'error': 'No files could be converted', 'details': errors}), 400
         
-        return jsonify({
-            'success': True,
-            'single_file': False,
-            'download_url': f"/download/{zip_filename}",
-            'filename': zip_filename,
-            'converted_count': len(converted_files),
-            'errors': errors if errors else None
-        })
+        try:
+            return run_conversions(uploads, output_format, manifest.get('compress') == 'max', max_dim, errors)
+        except Exception:
+            # Whatever was not converted or removed yet is left for the janitor
+            schedule_expiry(*(temp_path for _, _, temp_path, _ in uploads))
+            raise
         
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}'}), 500
@@ -946,37 +1220,64 @@ def download_file(filename):
         if not os.path.exists(file_path):
             return "File not found", 404
         
-        return send_file(file_path, as_attachment=True, download_name=filename)
+        return send_file(file_path, as_attachment=True, download_name=filename,
+                         conditional=True, etag=True, max_age=0)
+        
+    except Exception as e:
+        return f"Download error: {str(e)}", 500
+
+@app.route('/download-archive/<zip_filename>')
+def download_archive(zip_filename):
+    """Stream a zip of converted files; images are already compressed, so store only"""
+    try:
+        # Open each file once; the descriptors stay open until the response closes
+        entries = []
+        def close_entries():
+            for fd, _, _ in entries:
+                os.close(fd)
+        
+        for name in request.args.get('files', '').split(','):
+            name = secure_filename(name)
+            try:
+                fd = os.open(os.path.join(CONVERTED_FOLDER, name), os.O_RDONLY) if name else None
+            except OSError:
+                fd = None
+            if fd is not None:
+                entries.append((fd, name, os.fstat(fd)))
+            if fd is None or not stat.S_ISREG(entries[-1][2].st_mode):
+                close_entries()
+                return "File not found", 404
+        
+        response = Response(stream_archive(entries), mimetype='application/zip', headers={
+            'Content-Disposition': f'attachment; filename="{secure_filename(zip_filename)}"'
+        })
+        response.call_on_close(close_entries)
+        return response
         
     except Exception as e:
         return f"Download error: {str(e)}", 500
 
 @app.route('/history')
 def get_history():
-    history = session.get('conversion_history', [])
-    return jsonify({'history': history})
+    return jsonify({'history': session_history()})
 
 @app.route('/clear-history', methods=['POST'])
 def clear_history():
-    session['conversion_history'] = []
-    session.modified = True
+    clear_session_history()
     return jsonify({'success': True})
 
 # Cleanup function to remove old files (call periodically)
 def cleanup_temp_files():
     """Remove files older than 1 hour from temp directories"""
-    import time
     current_time = time.time()
     
+    stale = []
     for folder in [UPLOAD_FOLDER, CONVERTED_FOLDER]:
-        for filename in os.listdir(folder):
-            file_path = os.path.join(folder, filename)
-            if os.path.isfile(file_path):
-                if current_time - os.path.getctime(file_path) > 3600:  # 1 hour
-                    try:
-                        os.remove(file_path)
-                    except OSError:
-                        pass
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_file() and current_time - entry.stat().st_ctime > 3600:  # 1 hour
+                    stale.append(entry.path)
+    unlink_batch(stale)
 
 if __name__ == '__main__':
     print("🖼️  HEIC Image Converter Server Starting...")
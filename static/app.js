@@ -0,0 +1,241 @@
+let selectedFiles = [];
+
+// File input change event
+document.getElementById('fileInput').addEventListener('change', handleFileSelect);
+
+// Drag and drop functionality
+const uploadSection = document.querySelector('.upload-section');
+
+uploadSection.addEventListener('dragover', (e) => {
+    e.preventDefault();
+    uploadSection.classList.add('dragover');
+});
+
+uploadSection.addEventListener('dragleave', () => {
+    uploadSection.classList.remove('dragover');
+});
+
+uploadSection.addEventListener('drop', (e) => {
+    e.preventDefault();
+    uploadSection.classList.remove('dragover');
+    const files = e.dataTransfer.files;
+    handleFiles(files);
+});
+
+function handleFileSelect(e) {
+    handleFiles(e.target.files);
+}
+
+function handleFiles(files) {
+    selectedFiles = Array.from(files).filter(file => {
+        const ext = file.name.split('.').pop().toLowerCase();
+        return ['heic', 'heif', 'jpg', 'jpeg', 'png', 'bmp', 'gif', 'tiff', 'webp'].includes(ext);
+    });
+
+    if (selectedFiles.length === 0) {
+        alert(`Please select supported image files (${document.body.dataset.formats}).`);
+        return;
+    }
+
+    displaySelectedFiles();
+    document.getElementById('convertBtn').style.display = 'inline-block';
+}
+
+function displaySelectedFiles() {
+    const fileList = document.getElementById('fileList');
+    const selectedFilesDiv = document.getElementById('selectedFiles');
+
+    fileList.innerHTML = '';
+
+    selectedFiles.forEach((file, index) => {
+        const fileItem = document.createElement('div');
+        fileItem.className = 'file-item';
+        fileItem.innerHTML = `
+            <div class="file-info">
+                <div class="file-name">${file.name}</div>
+                <div class="file-size">${formatFileSize(file.size)}</div>
+            </div>
+        `;
+        fileList.appendChild(fileItem);
+    });
+
+    selectedFilesDiv.style.display = 'block';
+}
+
+function formatFileSize(bytes) {
+    if (bytes === 0) return '0 Bytes';
+    const k = 1024;
+    const sizes = ['Bytes', 'KB', 'MB', 'GB'];
+    const i = Math.floor(Math.log(bytes) / Math.log(k));
+    return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + ' ' + sizes[i];
+}
+
+async function convertFiles() {
+    if (selectedFiles.length === 0) {
+        alert('Please select files first.');
+        return;
+    }
+
+    const format = document.querySelector('input[name="format"]:checked').value;
+
+    // Show loading
+    document.getElementById('loading').style.display = 'block';
+    document.getElementById('resultSection').style.display = 'none';
+    document.getElementById('convertBtn').disabled = true;
+
+    try {
+        // One multipart/mixed request: a JSON manifest, then each file's bytes in order
+        const boundary = 'batch-' + Math.random().toString(16).slice(2) + Math.random().toString(16).slice(2);
+        const manifest = {
+            format: format,
+            files: selectedFiles.map(file => ({ name: file.name, size: file.size }))
+        };
+        const parts = [
+            `--${boundary}\r\nContent-Disposition: form-data; name="manifest"\r\nContent-Type: application/json\r\n\r\n`,
+            JSON.stringify(manifest)
+        ];
+        selectedFiles.forEach((file, i) => {
+            parts.push(`\r\n--${boundary}\r\nContent-Disposition: attachment; filename="${i}"\r\nContent-Type: application/octet-stream\r\n\r\n`, file);
+        });
+        parts.push(`\r\n--${boundary}--\r\n`);
+
+        const response = await fetch('/convert-batch', {
+            method: 'POST',
+            headers: { 'Content-Type': `multipart/mixed; boundary=${boundary}` },
+            body: new Blob(parts)
+        });
+
+        const result = await response.json();
+
+        // Hide loading
+        document.getElementById('loading').style.display = 'none';
+        document.getElementById('convertBtn').disabled = false;
+
+        if (result.success) {
+            showResult(result);
+            loadHistory(); // Reload history
+
+            // Reset form
+            selectedFiles = [];
+            document.getElementById('fileInput').value = '';
+            document.getElementById('selectedFiles').style.display = 'none';
+            document.getElementById('convertBtn').style.display = 'none';
+        } else {
+            showError(result.error, result.details);
+        }
+
+    } catch (error) {
+        document.getElementById('loading').style.display = 'none';
+        document.getElementById('convertBtn').disabled = false;
+        showError('Network error: ' + error.message);
+    }
+}
+
+function showResult(result) {
+    const resultSection = document.getElementById('resultSection');
+    const resultMessage = document.getElementById('resultMessage');
+
+    let message = `
+        <div class="success-message">
+            <h4>✅ Conversion Successful!</h4>
+            <p>Your ${result.single_file ? 'image has' : 'images have'} been converted successfully.</p>
+        </div>
+    `;
+
+    if (result.errors && result.errors.length > 0) {
+        message += `
+            <div class="error-message">
+                <h5>⚠️ Some files had issues:</h5>
+                <ul>
+                    ${result.errors.map(error => `<li>${error}</li>`).join('')}
+                </ul>
+            </div>
+        `;
+    }
+
+    message += `
+        <div style="margin-top: 20px;">
+            <a href="${result.download_url}" class="btn btn-success" download>
+                📥 Download ${result.single_file ? 'Image' : 'Archive'}
+            </a>
+        </div>
+    `;
+
+    resultMessage.innerHTML = message;
+    resultSection.style.display = 'block';
+}
+
+function showError(error, details = null) {
+    const resultSection = document.getElementById('resultSection');
+    const resultMessage = document.getElementById('resultMessage');
+
+    let message = `
+        <div class="error-message">
+            <h4>❌ Conversion Failed</h4>
+            <p>${error}</p>
+        </div>
+    `;
+
+    if (details && details.length > 0) {
+        message += `
+            <div class="error-message">
+                <h5>Details:</h5>
+                <ul>
+                    ${details.map(detail => `<li>${detail}</li>`).join('')}
+                </ul>
+            </div>
+        `;
+    }
+
+    resultMessage.innerHTML = message;
+    resultSection.style.display = 'block';
+}
+
+async function loadHistory() {
+    try {
+        const response = await fetch('/history');
+        const data = await response.json();
+        displayHistory(data.history);
+    } catch (error) {
+        console.error('Failed to load history:', error);
+    }
+}
+
+function displayHistory(history) {
+    const historyList = document.getElementById('historyList');
+
+    if (history.length === 0) {
+        historyList.innerHTML = `
+            <div class="empty-state">
+                <p>No conversion history yet. Convert some images to see your history here!</p>
+            </div>
+        `;
+        return;
+    }
+
+    historyList.innerHTML = history.map(item => `
+        <div class="history-item">
+            <div class="history-time">${item.timestamp}</div>
+            <div class="history-details">
+                Converted ${item.files_count} file${item.files_count > 1 ? 's' : ''} to ${item.output_format}
+            </div>
+            <div class="history-files">
+                Files: ${item.files.join(', ')}
+            </div>
+        </div>
+    `).join('');
+}
+
+async function clearHistory() {
+    if (confirm('Are you sure you want to clear the conversion history?')) {
+        try {
+            await fetch('/clear-history', { method: 'POST' });
+            loadHistory();
+        } catch (error) {
+            alert('Failed to clear history');
+        }
+    }
+}
+
+// Load history on page load
+document.addEventListener('DOMContentLoaded', loadHistory);